@@ -1,9 +1,11 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, Response, request, session, jsonify, send_file
 from flask_cors import CORS
 
 import os
+import atexit
 import torch
-import math
+import threading
+import uuid
 from pathlib import Path
 
 from util.util import load_audio, crop_audio
@@ -12,9 +14,15 @@ from dance_diffusion.api import RequestHandler, Request, RequestType, ModelType
 from diffusion_library.sampler import SamplerType
 from diffusion_library.scheduler import SchedulerType
 
-from .kgui.ddkg import DDKnowledgeGraph
+from .kgui.ddkg import read_header
+from .kgui._summary import SUMMARY_TYPES
+from .kgui.chunking import WINDOW_TYPES, split_chunks, recombine_chunks
+from .kgui.registry import ProjectRegistry, ProjectError
+from .kgui.metrics import MetricsRegistry, Trace
+from .kgui.events import EventBus
 
 PROJECT_DIR = Path("projects")
+MAX_LOADED_PROJECTS = 4
 
 ARG_TYPES = {
     # General inference
@@ -29,6 +37,8 @@ ARG_TYPES = {
 }
 
 app = Flask(__name__)
+# Signs the session cookie that remembers each client's project
+app.secret_key = os.environ.get("KGUI_SECRET_KEY") or os.urandom(32)
 CORS(app)
 
 # Init
@@ -39,7 +49,28 @@ use_autocast = True  # TODO: Make configurable
 request_handler = RequestHandler(
     device_accelerator, optimize_memory_use=False, use_autocast=True
 )
-ddkg = None
+inference_lock = threading.Lock()
+events = EventBus()
+projects = ProjectRegistry(
+    PROJECT_DIR, max_loaded=MAX_LOADED_PROJECTS, on_event=events.publish
+)
+metrics = MetricsRegistry()
+atexit.register(projects.save_snapshots)
+
+
+# Requests may target a project with ?project=<name>, otherwise the project this
+# client last loaded (kept in its session), otherwise the last loaded by anyone
+def selected_project():
+    return (
+        request.args.get("project") or session.get("project") or projects.current
+    )
+
+
+# Unknown or invalid project names; new projects are only created through /load
+@app.errorhandler(ProjectError)
+def handle_project_error(e):
+    return jsonify({"message": str(e)}), e.status_code
+
 
 # --------------------
 #  Project Management
@@ -48,10 +79,10 @@ ddkg = None
 
 @app.route("/load", methods=["POST"])
 def load_project():
-    global ddkg
-    ddkg = DDKnowledgeGraph(str(PROJECT_DIR / request.form["project_name"]))
+    ddkg = projects.load(request.form["project_name"])
     if ddkg:
         project_name = ddkg.root.name
+        session["project"] = project_name
         return jsonify(
             {"message": f"project loaded: {project_name}", "project": project_name}
         )
@@ -66,19 +97,27 @@ def load_project():
 # Sends the current project name
 @app.route("/project", methods=["GET"])
 def get_project():
-    if ddkg is not None:
-        return jsonify({"message": "success", "project_name": ddkg.root.name})
+    if selected_project() is not None:
+        return jsonify({"message": "success", "project_name": selected_project()})
     else:
         return jsonify({"message:": "no project selected"})
     
 # Lists projects currently in the local save directory
 @app.route("/list-projects", methods=["GET"])
 def list_projects():
-    project_names = []
-    for path in PROJECT_DIR.iterdir():
-        if path.is_dir(): project_names.append(path.name)
-    if len(project_names > 0):
-        return jsonify({"message": "success", "project_names": project_names})
+    headers = []
+    if PROJECT_DIR.exists():
+        for path in PROJECT_DIR.iterdir():
+            if path.is_dir():
+                headers.append({"name": path.name, **read_header(path)})
+    if len(headers) > 0:
+        return jsonify(
+            {
+                "message": "success",
+                "project_names": [p["name"] for p in headers],
+                "projects": headers,
+            }
+        )
     else:
         return jsonify({"message:": "no projects found"})
 
@@ -94,11 +133,31 @@ def get_type_names():
     )
 
 
+# Streams progress and graph change events as Server-Sent Events
+@app.route("/events", methods=["GET"])
+def stream_events():
+    return Response(
+        events.stream(project=request.args.get("project")),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# Sends request stage metrics in Prometheus text format
+@app.route("/metrics", methods=["GET"])
+def get_metrics():
+    return Response(
+        metrics.to_prometheus(), content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
 # Sends the current graph state
 @app.route("/graph", methods=["GET"])
 def get_graph():
-    if ddkg is not None:
-        return jsonify({"message": "success", "graph_data": ddkg.to_json()})
+    if selected_project() is not None:
+        with projects.read(selected_project()) as ddkg:
+            graph_data = ddkg.to_json()
+        return jsonify({"message": "success", "graph_data": graph_data})
     else:
         return jsonify({"message:": "no project selected"})
 
@@ -106,8 +165,41 @@ def get_graph():
 # Sends the current graph state
 @app.route("/graph-tsne", methods=["GET"])
 def get_graph_tsne():
-    if ddkg is not None:
-        return jsonify({"message": "success", "graph_data": ddkg.to_json("cluster")})
+    if selected_project() is not None:
+        with projects.read(selected_project()) as ddkg:
+            graph_data = ddkg.to_json("cluster")
+        return jsonify({"message": "success", "graph_data": graph_data})
+    else:
+        return jsonify({"message:": "no project selected"})
+
+
+# Sends the graph with batches and sets collapsed into summary nodes.
+# Batches/sets listed in ?expand=a,b are sent with their children.
+@app.route("/graph-summary", methods=["GET"])
+def get_graph_summary():
+    if selected_project() is not None:
+        expand = [name for name in request.args.get("expand", "").split(",") if name]
+        with projects.read(selected_project()) as ddkg:
+            graph_data = ddkg.to_json("summary", expand=expand)
+        return jsonify({"message": "success", "graph_data": graph_data})
+    else:
+        return jsonify({"message:": "no project selected"})
+
+
+# Sends the children of a single collapsed batch or set
+@app.route("/graph-children", methods=["GET"])
+def get_graph_children():
+    if selected_project() is not None:
+        name = request.args.get("name")
+        if not name:
+            return jsonify({"message": "Missing batch or set name"}), 400
+        with projects.read(selected_project()) as ddkg:
+            if not ddkg.G.has_node(name):
+                return jsonify({"message": f"Unknown node: {name}"}), 404
+            if ddkg.G.nodes[name].get("type") not in SUMMARY_TYPES:
+                return jsonify({"message": f"Not a batch or set: {name}"}), 400
+            graph_data = ddkg.children_json(name)
+        return jsonify({"message": "success", "graph_data": graph_data})
     else:
         return jsonify({"message:": "no project selected"})
 
@@ -115,25 +207,28 @@ def get_graph_tsne():
 # Sends an audio file corresponding to the given name
 @app.route("/audio", methods=["GET"])
 def get_audio():
-    path = (ddkg.root / ddkg.G.nodes[request.args.get("name")]["path"]).resolve()
+    with projects.read(selected_project()) as ddkg:
+        path = (ddkg.root / ddkg.G.nodes[request.args.get("name")]["path"]).resolve()
     return send_file(str(path))
 
 
 # Copy an audio file to a new folder for easier access
 @app.route("/export-single", methods=["POST"])
 def export_single():
-    ddkg.export_single(
-        name=request.form["name"], export_name=request.form["export_name"]
-    )
+    with projects.read(selected_project()) as ddkg:
+        ddkg.export_single(
+            name=request.form["name"], export_name=request.form["export_name"]
+        )
     return jsonify({"message": "success"})
 
 
 # Copy an audio batch to a new folder for easier access
 @app.route("/export-batch", methods=["POST"])
 def export_batch():
-    ddkg.export_batch(
-        name=request.form["name"], export_name=request.form["export_name"]
-    )
+    with projects.read(selected_project()) as ddkg:
+        ddkg.export_batch(
+            name=request.form["name"], export_name=request.form["export_name"]
+        )
     return jsonify({"message": "success"})
 
 
@@ -145,37 +240,42 @@ def export_batch():
 # Copies a model to the ddkg dir
 @app.route("/import-model", methods=["POST"])
 def import_model():
-    if ddkg.import_model(
-        name=request.form["model_name"],
-        path=request.form["model_path"],
-        chunk_size=int(request.form["chunk_size"]),
-        sample_rate=int(request.form["sample_rate"]),
-        steps=int(request.form["steps"]),
-        copy=False,
-    ):
-        message = "Model imported successfully"
-    else:
-        message = f'Model import failed: model id {request.form["name"]}'
+    with projects.write(selected_project()) as ddkg:
+        if ddkg.import_model(
+            name=request.form["model_name"],
+            path=request.form["model_path"],
+            chunk_size=int(request.form["chunk_size"]),
+            sample_rate=int(request.form["sample_rate"]),
+            steps=int(request.form["steps"]),
+            copy=False,
+        ):
+            message = "Model imported successfully"
+        else:
+            message = f'Model import failed: model id {request.form["name"]}'
 
-    ddkg.save()
+        ddkg.save()
     return jsonify({"message": message})
 
 
 # Adds an external source
 @app.route("/add-external-source", methods=["POST"])
 def add_source():
-    ddkg.add_external_source(request.form["source_name"], request.form["source_root"])
-    ddkg.scan_external_source(request.form["source_name"])
-    ddkg.update_tsne()
-    ddkg.save()
+    with projects.write(selected_project()) as ddkg:
+        ddkg.add_external_source(
+            request.form["source_name"], request.form["source_root"]
+        )
+        ddkg.scan_external_source(request.form["source_name"])
+        ddkg.update_tsne()
+        ddkg.save()
     return jsonify({"message": "success"})
 
 
 @app.route("/rescan-source", methods=["POST"])
 def scan_source():
-    ddkg.scan_external_source(request.args.get("name"))
-    ddkg.update_tsne()
-    ddkg.save()
+    with projects.write(selected_project()) as ddkg:
+        ddkg.scan_external_source(request.args.get("name"))
+        ddkg.update_tsne()
+        ddkg.save()
     return jsonify({"message": "success"})
 
 
@@ -192,45 +292,107 @@ def handle_sd_request():
         k: ARG_TYPES[k](v) if k in ARG_TYPES else v for k, v in request.form.items()
     }
 
-    # Get model parameters from graph by name
-    model_node = ddkg.G.nodes[args["model_name"]]
-    args["model_path"] = ddkg.root / model_node["path"]
-    args["sample_rate"] = model_node["sample_rate"]
-
-    # Load audio source if specified
-    audio_source = None
-    if args.get("audio_source_name"):
-        audio_node = ddkg.G.nodes[args["audio_source_name"]]
-        audio_source = load_audio(
-            device_accelerator,
-            ddkg.root / audio_node["path"],
-            model_node["sample_rate"],
+    if args.get("crossfade_window", "linear") not in WINDOW_TYPES:
+        return (
+            jsonify({"message": f'Unknown crossfade window: {args["crossfade_window"]}'}),
+            400,
         )
-        # Duplicate channel if source is mono
-        if audio_source.size(0) == 1:
-            audio_source = audio_source.repeat(2, 1)
-    else:
-        args["audio_source_name"] = None
-
-    request_type = RequestType[args["mode"]]
-
-    if request_type == RequestType.Variation and args["split_chunks"] == "true":
-        # Split into a sequence of smaller variation runs
-        n_chunks = math.ceil(audio_source.size(-1) / args["chunk_interval"])
-        # The following could be used to avoid some padding:
-        # n_chunks = math.ceil((audio_source.size(1) - args['chunk_size']) / args['chunk_interval']) + 1
-        source_chunks = []
-        for chunk_index in range(n_chunks):
-            chunk = torch.zeros(2, args["chunk_size"], device=device_accelerator)
-            start = chunk_index * args["chunk_interval"]
-            end = min(start + args["chunk_size"], audio_source.size(-1))
-            chunk[:, : end - start] += audio_source[:, start:end]
-            source_chunks.append(chunk)
-        output_chunks = []
-        for chunk_index, chunk in enumerate(source_chunks):
-            print(f"Processing chunk {chunk_index + 1}/{len(source_chunks)}")
-
-            # Construct sample diffusion request
+
+    project_name = selected_project()
+    request_id = request.args.get("request_id") or uuid.uuid4().hex
+    trace = Trace("sd_request", metrics)
+    events.publish(
+        "sd_progress", project=project_name, request_id=request_id, stage="started"
+    )
+    try:
+        with projects.read(project_name) as ddkg:
+            # Get model parameters from graph by name
+            model_node = ddkg.G.nodes[args["model_name"]]
+            args["model_path"] = ddkg.root / model_node["path"]
+            args["sample_rate"] = model_node["sample_rate"]
+
+            # Load audio source if specified
+            audio_source = None
+            if args.get("audio_source_name"):
+                audio_node = ddkg.G.nodes[args["audio_source_name"]]
+                with trace.span("load_audio") as span:
+                    audio_source = load_audio(
+                        device_accelerator,
+                        ddkg.root / audio_node["path"],
+                        model_node["sample_rate"],
+                    )
+                    # Duplicate channel if source is mono
+                    if audio_source.size(0) == 1:
+                        audio_source = audio_source.repeat(2, 1)
+                    span.record_tensor("audio_source", audio_source)
+            else:
+                args["audio_source_name"] = None
+
+        request_type = RequestType[args["mode"]]
+
+        if request_type == RequestType.Variation and args["split_chunks"] == "true":
+            # Split into a sequence of smaller variation runs
+            with trace.span("build_chunks") as span:
+                source_chunks = split_chunks(
+                    audio_source, args["chunk_size"], args["chunk_interval"]
+                )
+                span.attrs["n_chunks"] = len(source_chunks)
+            output_chunks = []
+            for chunk_index, chunk in enumerate(source_chunks):
+                print(f"Processing chunk {chunk_index + 1}/{len(source_chunks)}")
+                events.publish(
+                    "sd_progress",
+                    project=project_name,
+                    request_id=request_id,
+                    stage="process_request",
+                    chunk_index=chunk_index,
+                    n_chunks=len(source_chunks),
+                )
+
+                # Construct sample diffusion request
+                sd_request = Request(
+                    request_type=request_type,
+                    model_type=ModelType.DD,
+                    model_chunk_size=args["chunk_size"],
+                    model_sample_rate=args["sample_rate"],
+                    sampler_type=SamplerType[args["sampler_type_name"]],
+                    sampler_args={"use_tqdm": True},
+                    scheduler_type=SchedulerType[args["scheduler_type_name"]],
+                    scheduler_args={
+                        "sigma_min": 0.1,  # TODO: make configurable
+                        "sigma_max": 50.0,  # TODO: make configurable
+                        "rho": 1.0,  # TODO: make configurable
+                    },
+                    audio_source=crop_audio(chunk, chunk_size=args["chunk_size"]),
+                    **args,
+                )
+
+                # Get response, then log to ddkg
+                with trace.wait(
+                    "wait_inference", inference_lock, chunk_index=chunk_index
+                ), trace.span(
+                    "process_request", reset_cuda_peak=True, chunk_index=chunk_index
+                ) as span:
+                    output_chunks.append(
+                        request_handler.process_request(sd_request).result
+                    )
+                    span.record_tensor("output", output_chunks[-1])
+
+            # Recombine chunks
+            with trace.span("recombine") as span:
+                output = recombine_chunks(
+                    output_chunks,
+                    audio_source.size(-1),
+                    args["chunk_size"],
+                    args["chunk_interval"],
+                    args["crossfade"] == "true",
+                    args.get("crossfade_window", "linear"),
+                )
+                span.record_tensor("output", output)
+
+        else:
+            if audio_source is not None:
+                audio_source = crop_audio(audio_source, chunk_size=args["chunk_size"])
             sd_request = Request(
                 request_type=request_type,
                 model_type=ModelType.DD,
@@ -244,66 +406,53 @@ def handle_sd_request():
                     "sigma_max": 50.0,  # TODO: make configurable
                     "rho": 1.0,  # TODO: make configurable
                 },
-                audio_source=crop_audio(chunk, chunk_size=args["chunk_size"]),
+                audio_source=audio_source,
                 **args,
             )
 
             # Get response, then log to ddkg
-            output_chunks.append(request_handler.process_request(sd_request).result)
-
-        # Recombine chunks
-        output = torch.zeros(
-            args["batch_size"], 2, audio_source.size(-1), device=device_accelerator
+            events.publish(
+                "sd_progress",
+                project=project_name,
+                request_id=request_id,
+                stage="process_request",
+            )
+            with trace.wait("wait_inference", inference_lock), trace.span(
+                "process_request", reset_cuda_peak=True
+            ) as span:
+                output = request_handler.process_request(sd_request).result
+                span.record_tensor("output", output)
+
+        events.publish(
+            "sd_progress", project=project_name, request_id=request_id, stage="logging"
         )
-        overlap = args['chunk_size'] - args["chunk_interval"]
-        left_fade = torch.zeros(args["chunk_size"], device=device_accelerator)
-        right_fade = torch.zeros(args["chunk_size"], device=device_accelerator)
-        if args["crossfade"]:
-            left_fade[:overlap] += torch.linspace(0, 1, overlap, device=device_accelerator)
-            left_fade[overlap:] += 1
-            right_fade[-overlap:] += torch.linspace(1, 0, overlap, device=device_accelerator)
-            right_fade[:-overlap] += 1
-        else:
-            left_fade[:] += 1
-            right_fade[: args["chunk_interval"]] += 1
-        mask = torch.zeros(args["chunk_size"], device=device_accelerator)
-        mask[: args["chunk_interval"]] += 1
-        for chunk_index, chunk in enumerate(output_chunks):
-            start = chunk_index * args["chunk_interval"]
-            end = min(start + args["chunk_size"], output.size(-1))
-            if chunk_index > 0:
-                chunk *= left_fade
-            if chunk_index < len(output_chunks):
-                chunk *= right_fade
-            output[:, :, start:end] += chunk[:, :, : end - start]
-
-    else:
-        if audio_source is not None:
-            audio_source = crop_audio(audio_source, chunk_size=args["chunk_size"])
-        sd_request = Request(
-            request_type=request_type,
-            model_type=ModelType.DD,
-            model_chunk_size=args["chunk_size"],
-            model_sample_rate=args["sample_rate"],
-            sampler_type=SamplerType[args["sampler_type_name"]],
-            sampler_args={"use_tqdm": True},
-            scheduler_type=SchedulerType[args["scheduler_type_name"]],
-            scheduler_args={
-                "sigma_min": 0.1,  # TODO: make configurable
-                "sigma_max": 50.0,  # TODO: make configurable
-                "rho": 1.0,  # TODO: make configurable
-            },
-            audio_source=audio_source,
-            **args,
+        with trace.wait("wait_write", projects.write(project_name)) as ddkg:
+            with trace.span("log_inference"):
+                ddkg.log_inference(output=output, **args)
+            with trace.span("update_tsne"):
+                ddkg.update_tsne()
+            with trace.span("save"):
+                ddkg.save()
+        events.publish(
+            "sd_progress", project=project_name, request_id=request_id, stage="done"
         )
+    except Exception as e:
+        # Let listeners know the request will not finish
+        events.publish(
+            "sd_progress",
+            project=project_name,
+            request_id=request_id,
+            stage="failed",
+            error=str(e),
+        )
+        raise
 
-        # Get response, then log to ddkg
-        output = request_handler.process_request(sd_request).result
-
-    ddkg.log_inference(output=output, **args)
-    ddkg.update_tsne()
-    ddkg.save()
-    return jsonify({"message": "success"})
+    # Per-request stage timings are returned with ?trace=true
+    if request.args.get("trace") == "true":
+        return jsonify(
+            {"message": "success", "request_id": request_id, "trace": trace.to_json()}
+        )
+    return jsonify({"message": "success", "request_id": request_id})
 
 
 # --------------------
@@ -313,20 +462,23 @@ def handle_sd_request():
 
 @app.route("/update-element", methods=["POST"])
 def update_element():
-    ddkg.update_element(request.form["name"], dict(request.form))
-    ddkg.save()
+    with projects.write(selected_project()) as ddkg:
+        ddkg.update_element(request.form["name"], dict(request.form))
+        ddkg.save()
     return jsonify({"message": "success"})
 
 
 @app.route("/update-batch", methods=["POST"])
 def update_batch():
-    ddkg.update_batch(request.form["name"], dict(request.form))
-    ddkg.save()
+    with projects.write(selected_project()) as ddkg:
+        ddkg.update_batch(request.form["name"], dict(request.form))
+        ddkg.save()
     return jsonify({"message": "success"})
 
 
 @app.route("/remove-element", methods=["POST"])
 def remove_element():
-    ddkg.remove_element(request.form["name"])
-    ddkg.save()
+    with projects.write(selected_project()) as ddkg:
+        ddkg.remove_element(request.form["name"])
+        ddkg.save()
     return jsonify({"message": "success"})
@@ -53,4 +53,6 @@ def update_tsne(
     for name, result in zip(names, tsne_results):
         attrs[name] = {f'tsne_{dim + 1}': float(result[dim]) for dim in range(n_components)}
     
-    nx.set_node_attributes(self.G, attrs)
\ No newline at end of file
+    nx.set_node_attributes(self.G, attrs)
+    self.rebuild_summaries()
+    self.emit('tsne_updated', n_nodes=len(names))
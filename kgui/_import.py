@@ -35,6 +35,7 @@ def import_model(
         type='model',
         created=int(time()),
     )
+    self.emit('nodes_added', names=[name])
 
     return True
 
@@ -46,6 +47,7 @@ def add_external_source(
     source_root: str,
 ):
     self.G.add_node(source_name, path=source_root, type='external', created=int(time()))
+    self.emit('nodes_added', names=[source_name])
 
 
 def scan_dir(
@@ -82,6 +84,7 @@ def scan_dir(
                     created=current_time,
                     parent=parent_node,
                 )
+                self.summary_add(child_path.stem)
                 print(f'Added {child_path.stem} to {parent_path.name}')
     
 # Scan external source
@@ -91,6 +94,7 @@ def scan_external_source(
 ):
     current_time = int(time())
     source_root = Path(self.G.nodes[source_name]['path'])
+    existing = set(self.G.nodes)
 
     # Add/update audio sets
     for audio_set_dir in source_root.iterdir():
@@ -105,6 +109,10 @@ def scan_external_source(
                 )
             self.scan_dir(audio_set_dir, set_name, current_time)
 
+    added = [node for node in self.G.nodes if node not in existing]
+    if added:
+        self.emit('nodes_added', names=added)
+
     # TODO: Remove nodes for data that no longer exists
 
 
@@ -125,6 +133,7 @@ def import_audio_set(
     sample_prefix = f'{source_name}_{set_name}'
     self.G.add_node(set_name, alias=set_name, type='set', created=current_time)
     self.G.add_edge(source_name, set_name, type='import', created=current_time)
+    added = [set_name]
 
     # Iterate through samples
     set_dir_new = check_dir(self.root / audio_dir / source_name / set_name)
@@ -150,4 +159,8 @@ def import_audio_set(
                 created=current_time,
                 parent=set_name,
             )
+            self.summary_add(sample_path.stem)
+            added.append(sample_path.stem)
+
+    self.emit('nodes_added', names=added)
 
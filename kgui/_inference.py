@@ -59,6 +59,7 @@ def log_inference(
 
     # Create individual samples
     batch_dir = check_dir(self.root / audio_dir / mode / model_name)
+    added = [batch_name]
     for i, sample in enumerate(output):
         # Save audio
         batch_index = i + 1
@@ -79,6 +80,8 @@ def log_inference(
             created=current_time,
             parent=batch_name,
         )
+        self.summary_add(audio_name)
+        added.append(audio_name)
         '''
         self.G.add_edge(
             audio_name,
@@ -87,4 +90,6 @@ def log_inference(
             created=current_time
         )
         '''
+
+    self.emit('nodes_added', names=added)
     return True
@@ -0,0 +1,106 @@
+import os
+import re
+import json
+
+from pathlib import Path
+
+import networkx as nx
+
+from .util import *
+
+SNAPSHOT_VERSION = 2
+
+GENERATION_PATTERN = re.compile(r'^\{\s*"generation":\s*(\d+)')
+
+
+# Read the save generation from the start of a json file without parsing the rest.
+# save() and save_snapshot() always write "generation" as the first key.
+def read_generation(path):
+    try:
+        with open(path, 'r') as f:
+            match = GENERATION_PATTERN.match(f.read(128))
+    except OSError:
+        return None
+    return int(match.group(1)) if match else None
+
+
+# Group items by their attribute names and store each group as columns.
+# Far fewer objects to parse than one dict per node, and nothing is executed on load.
+def to_columns(items):
+    groups = {}
+    for key, attrs in items:
+        names = tuple(attrs)
+        group = groups.get(names)
+        if group is None:
+            group = groups[names] = {
+                'keys': list(names), 'ids': [], 'columns': [[] for _ in names]
+            }
+        group['ids'].append(key)
+        for column, name in zip(group['columns'], names):
+            column.append(attrs[name])
+    return list(groups.values())
+
+
+def from_columns(groups):
+    for group in groups:
+        keys = group['keys']
+        rows = zip(*group['columns']) if keys else [()] * len(group['ids'])
+        for key, values in zip(group['ids'], rows):
+            yield key, dict(zip(keys, values))
+
+
+# Compact columnar snapshot of the graph for fast loading
+def save_snapshot(self):
+    nodes = list(self.G.nodes)
+    index = {node: i for i, node in enumerate(nodes)}
+    data = {
+        'generation': self.generation,
+        'version': SNAPSHOT_VERSION,
+        'project_name': self.project_name,
+        'export_target': str(self.export_target),
+        'nodes': to_columns(
+            (i, attrs) for i, (_, attrs) in enumerate(self.G.nodes(data=True))
+        ),
+        'edges': to_columns(
+            ([index[source], index[target]], attrs)
+            for source, target, attrs in self.G.edges(data=True)
+        ),
+        'node_order': nodes,
+        'summaries': self.summaries,
+    }
+    replace_file(self.root / snapshot_file, json.dumps(data, separators=(',', ':')))
+
+
+# Load the snapshot if it was written from the same save as ddkg.json
+def load_snapshot(self) -> bool:
+    generation = read_generation(self.root / data_file)
+    if generation is None or read_generation(self.root / snapshot_file) != generation:
+        return False
+    try:
+        with open(self.root / snapshot_file, 'r') as sf:
+            data = json.load(sf)
+        if data['version'] != SNAPSHOT_VERSION:
+            return False
+        nodes = data['node_order']
+        node_attrs = [None] * len(nodes)
+        for i, attrs in from_columns(data['nodes']):
+            node_attrs[i] = attrs
+        G = nx.DiGraph()
+        G.add_nodes_from(zip(nodes, node_attrs))
+        G.add_edges_from(
+            (nodes[source], nodes[target], attrs)
+            for (source, target), attrs in from_columns(data['edges'])
+        )
+        project_name = data['project_name']
+        export_target = Path(data['export_target'])
+        summaries = data['summaries']
+    except (OSError, ValueError, TypeError, KeyError, IndexError) as e:
+        print(f'Ignoring unreadable snapshot {self.root / snapshot_file}: {e}')
+        return False
+
+    self.generation = generation
+    self.project_name = project_name
+    self.export_target = export_target
+    self.G = G
+    self.summaries = summaries
+    return True
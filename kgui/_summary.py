@@ -0,0 +1,180 @@
+import networkx as nx
+
+from .util import *
+
+SUMMARY_TYPES = ('batch', 'set')
+
+
+# Rating, tags and t-SNE position of an audio node, as used for aggregate stats
+def summary_contribution(data: dict):
+    try:
+        rating = float(data.get('rating'))
+    except (TypeError, ValueError):
+        rating = None
+    tags = [tag for tag in (data.get('tags') or '').split(',') if tag != '']
+    if 'tsne_1' in data and 'tsne_2' in data:
+        tsne = (data['tsne_1'], data['tsne_2'])
+    else:
+        tsne = None
+    return rating, tags, tsne
+
+
+def empty_summary() -> dict:
+    return {
+        'child_count': 0,
+        'rating_sum': 0.0,
+        'rating_count': 0,
+        'tags': {},
+        'tsne_sum': [0.0, 0.0],
+        'tsne_count': 0,
+    }
+
+
+# Add (sign=1) or remove (sign=-1) an audio node's contribution to its parent summary
+def summary_update(self, node: str, sign: int = 1):
+    if not self.G.has_node(node):
+        return
+    data = self.G.nodes[node]
+    parent = data.get('parent')
+    if data.get('type') != 'audio' or parent is None:
+        return
+
+    summary = self.summaries.setdefault(parent, empty_summary())
+    rating, tags, tsne = summary_contribution(data)
+    summary['child_count'] += sign
+    if rating is not None:
+        summary['rating_sum'] += sign * rating
+        summary['rating_count'] += sign
+    for tag in tags:
+        count = summary['tags'].get(tag, 0) + sign
+        if count > 0:
+            summary['tags'][tag] = count
+        else:
+            summary['tags'].pop(tag, None)
+    if tsne is not None:
+        summary['tsne_sum'][0] += sign * tsne[0]
+        summary['tsne_sum'][1] += sign * tsne[1]
+        summary['tsne_count'] += sign
+
+
+def summary_add(self, node: str):
+    self.summary_update(node, 1)
+
+
+def summary_remove(self, node: str):
+    self.summary_update(node, -1)
+
+
+def rebuild_summaries(self):
+    self.summaries = {}
+    for node in self.G.nodes:
+        self.summary_update(node, 1)
+
+
+# Combine raw summaries into the stats sent to clients
+def summary_stats(summaries: list) -> dict:
+    total = empty_summary()
+    for summary in summaries:
+        total['child_count'] += summary['child_count']
+        total['rating_sum'] += summary['rating_sum']
+        total['rating_count'] += summary['rating_count']
+        for tag, count in summary['tags'].items():
+            total['tags'][tag] = total['tags'].get(tag, 0) + count
+        total['tsne_sum'][0] += summary['tsne_sum'][0]
+        total['tsne_sum'][1] += summary['tsne_sum'][1]
+        total['tsne_count'] += summary['tsne_count']
+
+    stats = {
+        'child_count': total['child_count'],
+        'mean_rating': None,
+        'tag_histogram': total['tags'],
+        'tsne_centroid': None,
+    }
+    if total['rating_count'] > 0:
+        stats['mean_rating'] = total['rating_sum'] / total['rating_count']
+    if total['tsne_count'] > 0:
+        stats['tsne_centroid'] = [
+            total['tsne_sum'][0] / total['tsne_count'],
+            total['tsne_sum'][1] / total['tsne_count'],
+        ]
+    return stats
+
+
+# Collapsed view: batches and sets carry summaries instead of their audio children.
+# Children of the names in expand are included as usual.
+def to_summary_json(self, expand=()):
+    expand = set(expand)
+    S = nx.DiGraph()
+    for node, data in self.G.nodes(data=True):
+        parent = data.get('parent')
+        if data.get('type') == 'audio' and parent is not None and parent not in expand:
+            continue
+        S.add_node(node, **data)
+        if data.get('type') in SUMMARY_TYPES:
+            S.nodes[node]['summary'] = summary_stats(
+                [self.summaries.get(node, empty_summary())]
+            )
+            S.nodes[node]['expanded'] = node in expand
+        elif data.get('type') == 'model':
+            batches = [
+                target for _, target in self.G.out_edges(node)
+                if self.G.nodes[target].get('type') == 'batch'
+            ]
+            S.nodes[node]['summary'] = summary_stats(
+                [self.summaries.get(batch, empty_summary()) for batch in batches]
+            )
+            S.nodes[node]['summary']['batch_count'] = len(batches)
+
+    # Edges from collapsed audio nodes (e.g. variation sources) attach to their parent
+    def visible(node):
+        if S.has_node(node):
+            return node
+        parent = self.G.nodes[node].get('parent')
+        return parent if S.has_node(parent) else None
+
+    for source, target, data in self.G.edges(data=True):
+        source, target = visible(source), visible(target)
+        if source is not None and target is not None and source != target:
+            S.add_edge(source, target, **data)
+    return nx.cytoscape.cytoscape_data(S)
+
+
+# Audio children of a collapsed batch or set, with the edges that touch them.
+# Only the children are sent as nodes. An edge to a node outside the batch is
+# sent on its own, pointing at the node as shown in the collapsed view (a
+# collapsed audio node is replaced by its parent), so existing client nodes are
+# never overwritten.
+def children_json(self, name: str):
+    children = {
+        node for node, parent in self.G.nodes(data='parent') if parent == name
+    }
+
+    def visible(node):
+        if node in children:
+            return node
+        data = self.G.nodes[node]
+        if data.get('type') == 'audio' and data.get('parent') is not None:
+            return data['parent']
+        return node
+
+    C = nx.DiGraph()
+    outside_edges = {}
+    for node in children:
+        C.add_node(node, **self.G.nodes[node])
+        edges = list(self.G.in_edges(node, data=True)) + list(
+            self.G.out_edges(node, data=True)
+        )
+        for source, target, data in edges:
+            if source in children and target in children:
+                C.add_edge(source, target, **data)
+                continue
+            source, target = visible(source), visible(target)
+            if source != target:
+                outside_edges[source, target] = data
+
+    graph_data = nx.cytoscape.cytoscape_data(C)
+    for (source, target), data in outside_edges.items():
+        graph_data['elements']['edges'].append(
+            {'data': {**data, 'source': source, 'target': target}}
+        )
+    return graph_data
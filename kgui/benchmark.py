@@ -0,0 +1,316 @@
+"""
+Benchmarks for kgui hot paths on synthetic projects.
+
+Runs on CPU with a stub request handler, so no checkpoints are needed:
+
+    python -m kgui.benchmark --sizes 1000 10000 100000 --output bench.json
+
+Results are written as JSON so runs can be compared across commits.
+"""
+import os
+import sys
+import json
+import argparse
+import platform
+import subprocess
+import tempfile
+
+from contextlib import redirect_stdout
+from pathlib import Path
+from time import perf_counter, time
+
+import numpy as np
+import soundfile as sf
+import torch
+
+from .ddkg import DDKnowledgeGraph
+from .chunking import split_chunks, recombine_chunks
+from .util import *
+
+OPERATIONS = [
+    'scan_external_source',
+    'rescan_external_source',
+    'save',
+    'save_snapshot',
+    'load_snapshot',
+    'load_json',
+    'to_json_batch',
+    'to_json_cluster',
+    'to_json_summary',
+    'update_tsne',
+    'update_batch',
+    'remove_element',
+    'recombine_chunks',
+]
+
+
+# Stands in for dance_diffusion's RequestHandler, returning noise of the right shape
+class StubRequestHandler:
+    def __init__(self, seed: int = 0) -> None:
+        self.generator = torch.Generator().manual_seed(seed)
+
+    def process_request(self, request):
+        if request.audio_source is not None:
+            shape = (request.batch_size, *request.audio_source.shape)
+        else:
+            shape = (request.batch_size, 2, request.model_chunk_size)
+        return StubResponse(torch.rand(shape, generator=self.generator) * 0.2 - 0.1)
+
+
+class StubResponse:
+    def __init__(self, result: torch.Tensor) -> None:
+        self.result = result
+
+
+class StubRequest:
+    def __init__(self, batch_size: int, model_chunk_size: int, audio_source=None):
+        self.batch_size = batch_size
+        self.model_chunk_size = model_chunk_size
+        self.audio_source = audio_source
+
+
+# Build a project with models, generated batches and an unscanned external source.
+# About 80% of the nodes come from batches and the rest from the external source.
+def generate_project(
+    root: Path,
+    n_nodes: int,
+    batch_size: int = 8,
+    set_size: int = 100,
+    audio_length: int = 2048,
+    sample_rate: int = 48000,
+    seed: int = 0,
+) -> DDKnowledgeGraph:
+    assert not (root / data_file).exists(), f'{root} already contains a project'
+
+    rng = np.random.default_rng(seed)
+    request_handler = StubRequestHandler(seed)
+    ddkg = DDKnowledgeGraph(str(root))
+    ddkg.project_name = root.name
+
+    n_models = max(1, n_nodes // 1000)
+    model_names = [f'model_{i}' for i in range(n_models)]
+    for model_name in model_names:
+        ddkg.import_model(
+            name=model_name,
+            path=str(root / model_dir / f'{model_name}.ckpt'),
+            chunk_size=audio_length,
+            sample_rate=sample_rate,
+            steps=50,
+        )
+
+    n_batches = max(1, int(n_nodes * 0.8) // (batch_size + 1))
+    for batch_index in range(n_batches):
+        output = request_handler.process_request(
+            StubRequest(batch_size, audio_length)
+        ).result
+        ddkg.log_inference(
+            mode='Generation',
+            model_name=model_names[batch_index % n_models],
+            sample_rate=sample_rate,
+            chunk_size=audio_length,
+            batch_size=batch_size,
+            seed=batch_index,
+            steps=50,
+            sampler_type_name='V_IPLMS',
+            scheduler_type_name='V_CRASH',
+            output=output,
+        )
+
+    source_root = check_dir(root / 'source')
+    n_sets = max(1, (n_nodes - ddkg.G.number_of_nodes()) // (set_size + 1))
+    for set_index in range(n_sets):
+        set_dir = check_dir(source_root / f'set_{set_index}')
+        for sample_index in range(set_size):
+            noise = rng.uniform(-0.1, 0.1, size=(audio_length, 2)).astype(np.float32)
+            sf.write(
+                str(set_dir / f'set_{set_index}_{sample_index}.wav'), noise, sample_rate
+            )
+    ddkg.add_external_source('source', str(source_root))
+
+    return ddkg
+
+
+def time_op(results: list, op: str, n_nodes, fn, repeat: int = 1):
+    times = []
+    for _ in range(repeat):
+        start = perf_counter()
+        value = fn()
+        times.append(perf_counter() - start)
+    results.append(
+        {'op': op, 'n_nodes': n_nodes, 'seconds': min(times), 'repeat': repeat}
+    )
+    print(f'{op:>24} n={n_nodes}: {min(times):.4f}s', file=sys.stderr)
+    return value
+
+
+def bench_project(
+    root: Path,
+    n_nodes: int,
+    ops: list,
+    results: list,
+    repeat: int = 3,
+    audio_length: int = 2048,
+    sample_rate: int = 48000,
+):
+    ddkg = generate_project(
+        root, n_nodes, audio_length=audio_length, sample_rate=sample_rate
+    )
+    n_nodes = ddkg.G.number_of_nodes()
+
+    if 'scan_external_source' in ops:
+        time_op(results, 'scan_external_source', n_nodes,
+                lambda: ddkg.scan_external_source('source'))
+    else:
+        ddkg.scan_external_source('source')
+    n_nodes = ddkg.G.number_of_nodes()
+
+    if 'rescan_external_source' in ops:
+        time_op(results, 'rescan_external_source', n_nodes,
+                lambda: ddkg.scan_external_source('source'), repeat)
+    if 'save' in ops:
+        time_op(results, 'save', n_nodes, ddkg.save, repeat)
+    else:
+        ddkg.save()
+    if 'save_snapshot' in ops:
+        time_op(results, 'save_snapshot', n_nodes, ddkg.save_snapshot, repeat)
+    else:
+        ddkg.save_snapshot()
+    if 'load_snapshot' in ops:
+        time_op(results, 'load_snapshot', n_nodes,
+                lambda: DDKnowledgeGraph(str(root)), repeat)
+    if 'load_json' in ops:
+        # Remove the snapshot so load() falls back to the json.
+        # This includes rewriting the snapshot, as happens on a real json load.
+        def load_json():
+            os.remove(root / snapshot_file)
+            return DDKnowledgeGraph(str(root))
+
+        time_op(results, 'load_json', n_nodes, load_json, repeat)
+    if 'to_json_batch' in ops:
+        time_op(results, 'to_json_batch', n_nodes,
+                lambda: ddkg.to_json('batch'), repeat)
+    if 'to_json_cluster' in ops:
+        time_op(results, 'to_json_cluster', n_nodes,
+                lambda: ddkg.to_json('cluster'), repeat)
+    if 'to_json_summary' in ops:
+        time_op(results, 'to_json_summary', n_nodes,
+                lambda: ddkg.to_json('summary'), repeat)
+    if 'update_tsne' in ops:
+        time_op(results, 'update_tsne', n_nodes,
+                lambda: ddkg.update_tsne(
+                    sample_rate=sample_rate, sample_size=audio_length
+                ))
+
+    batch_names = [
+        node for node, node_type in ddkg.G.nodes(data='type') if node_type == 'batch'
+    ]
+    if 'update_batch' in ops:
+        time_op(results, 'update_batch', n_nodes,
+                lambda: ddkg.update_batch(
+                    batch_names[0], {'alias': 'bench', 'apply_child_alias': 'true'}
+                ), repeat)
+    if 'remove_element' in ops:
+        time_op(results, 'remove_element', n_nodes,
+                lambda: ddkg.remove_element(batch_names[-1]))
+
+
+# Split a long source, run it through the stub handler and recombine
+def bench_recombine(
+    results: list,
+    repeat: int = 3,
+    length: int = 48000 * 60,
+    chunk_size: int = 65536,
+    chunk_interval: int = 49152,
+    batch_size: int = 4,
+    crossfade: bool = True,
+):
+    request_handler = StubRequestHandler()
+    audio_source = torch.rand(2, length) * 0.2 - 0.1
+    output_chunks = [
+        request_handler.process_request(
+            StubRequest(batch_size, chunk_size, audio_source=chunk)
+        ).result
+        for chunk in split_chunks(audio_source, chunk_size, chunk_interval)
+    ]
+    # recombine_chunks leaves its inputs untouched, so the same chunks are reused
+    time_op(results, 'recombine_chunks', None,
+            lambda: recombine_chunks(
+                output_chunks, length, chunk_size, chunk_interval, crossfade,
+            ), repeat)
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'],
+            cwd=Path(__file__).parent,
+            capture_output=True,
+            text=True,
+        ).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--ops', nargs='+', choices=OPERATIONS, default=OPERATIONS)
+    parser.add_argument('--skip', nargs='+', choices=OPERATIONS, default=[])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--audio-length', type=int, default=2048)
+    parser.add_argument('--sample-rate', type=int, default=48000)
+    parser.add_argument('--work-dir', type=str, default=None,
+                        help='Keep generated projects in a new subdirectory of this '
+                        'directory instead of a temp dir')
+    parser.add_argument('--output', type=str, default=None,
+                        help='Write results here instead of stdout')
+    args = parser.parse_args(argv)
+
+    ops = [op for op in args.ops if op not in args.skip]
+    results = []
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        if args.work_dir is None:
+            work_dir = Path(temp_dir)
+        else:
+            # A new run directory each time, so a reused work dir never clashes
+            work_dir = Path(tempfile.mkdtemp(
+                prefix='run_', dir=check_dir(Path(args.work_dir))
+            ))
+            print(f'Writing projects to {work_dir}', file=sys.stderr)
+        # Silence the per-file logging of the code under test
+        with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+            for n_nodes in args.sizes:
+                bench_project(
+                    work_dir / f'bench_{n_nodes}',
+                    n_nodes,
+                    ops,
+                    results,
+                    repeat=args.repeat,
+                    audio_length=args.audio_length,
+                    sample_rate=args.sample_rate,
+                )
+            if 'recombine_chunks' in ops:
+                bench_recombine(results, repeat=args.repeat)
+
+    report = {
+        'commit': git_commit(),
+        'created': int(time()),
+        'python': platform.python_version(),
+        'torch': torch.__version__,
+        'params': {
+            'audio_length': args.audio_length,
+            'sample_rate': args.sample_rate,
+            'repeat': args.repeat,
+        },
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(json.dumps(report, indent=4))
+    else:
+        print(json.dumps(report, indent=4))
+
+
+if __name__ == '__main__':
+    main()
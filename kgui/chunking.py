@@ -0,0 +1,111 @@
+import math
+import functools
+
+import torch
+import torch.nn.functional as F
+
+WINDOW_TYPES = ('linear', 'equal_power')
+
+
+# Split audio into a sequence of zero-padded chunks starting every chunk_interval
+def split_chunks(
+    audio_source: torch.Tensor, chunk_size: int, chunk_interval: int
+) -> list:
+    n_chunks = math.ceil(audio_source.size(-1) / chunk_interval)
+    # The following could be used to avoid some padding:
+    # n_chunks = math.ceil((audio_source.size(1) - chunk_size) / chunk_interval) + 1
+    padded_size = (n_chunks - 1) * chunk_interval + chunk_size
+    padded = F.pad(audio_source, (0, padded_size - audio_source.size(-1)))
+    # unfold gives overlapping views, so copy each chunk before it is processed
+    return [
+        chunk.clone()
+        for chunk in padded.unfold(-1, chunk_size, chunk_interval).unbind(-2)
+    ]
+
+
+# Fade windows for the first, middle and last chunk of a sequence.
+# Cached per configuration; the returned tensors must not be modified in place.
+@functools.lru_cache(maxsize=32)
+def chunk_windows(
+    chunk_size: int,
+    chunk_interval: int,
+    crossfade: bool = True,
+    window: str = 'linear',
+    device=None,
+    dtype=torch.float32,
+) -> tuple:
+    if window not in WINDOW_TYPES:
+        raise ValueError(f'Unknown window type {window}')
+    overlap = max(chunk_size - chunk_interval, 0)
+    left_fade = torch.ones(chunk_size, device=device, dtype=dtype)
+    right_fade = torch.ones(chunk_size, device=device, dtype=dtype)
+    if crossfade and overlap > 0:
+        ramp = torch.linspace(0, 1, overlap, device=device, dtype=dtype)
+        if window == 'equal_power':
+            left_fade[:overlap] = torch.sin(ramp * math.pi / 2)
+            right_fade[-overlap:] = torch.cos(ramp * math.pi / 2)
+        else:
+            left_fade[:overlap] = ramp
+            right_fade[-overlap:] = 1 - ramp
+    else:
+        # Hard cut: each chunk only contributes until the next one starts
+        right_fade[chunk_interval:] = 0
+
+    first = right_fade
+    middle = left_fade * right_fade
+    last = left_fade
+    return first, middle, last
+
+
+# Window and sum chunks (n_chunks, ..., chunk_size) placed every chunk_interval.
+# Linear and hard-cut windows sum to one wherever chunks overlap, so splitting and
+# recombining reconstructs the input exactly as long as chunk_interval >= overlap.
+# Equal-power windows keep the summed power constant instead.
+def overlap_add(
+    chunks,
+    length: int,
+    chunk_interval: int,
+    crossfade: bool = True,
+    window: str = 'linear',
+) -> torch.Tensor:
+    if not torch.is_tensor(chunks):
+        chunks = torch.stack(chunks)
+    n_chunks, chunk_size = chunks.size(0), chunks.size(-1)
+    lead_shape = chunks.shape[1:-1]
+
+    first, middle, last = chunk_windows(
+        chunk_size, chunk_interval, crossfade, window, chunks.device, chunks.dtype
+    )
+    if n_chunks == 1:
+        windows = torch.ones_like(first).unsqueeze(0)
+    else:
+        windows = torch.cat(
+            [first[None], middle.expand(n_chunks - 2, -1), last[None]]
+        )
+
+    # fold expects (1, channels * chunk_size, n_chunks)
+    weighted = chunks.reshape(n_chunks, -1, chunk_size) * windows[:, None, :]
+    columns = weighted.permute(1, 2, 0).reshape(1, -1, n_chunks)
+    padded_size = (n_chunks - 1) * chunk_interval + chunk_size
+    output = F.fold(
+        columns,
+        output_size=(1, padded_size),
+        kernel_size=(1, chunk_size),
+        stride=(1, chunk_interval),
+    )
+    output = output.reshape(*lead_shape, padded_size)[..., :length]
+    # Pad if the chunks do not cover the requested length
+    return F.pad(output, (0, length - output.size(-1)))
+
+
+# Recombine processed chunks (batch_size, channels, chunk_size) into one signal
+def recombine_chunks(
+    output_chunks: list,
+    length: int,
+    chunk_size: int,
+    chunk_interval: int,
+    crossfade: bool,
+    window: str = 'linear',
+) -> torch.Tensor:
+    assert output_chunks[0].size(-1) == chunk_size, 'Unexpected chunk size'
+    return overlap_add(output_chunks, length, chunk_interval, crossfade, window)
@@ -10,13 +10,26 @@ from .util import *
 
 DEFAULT_SR = 48000
 
+
+# Read the lightweight project header without loading the graph
+def read_header(data_path) -> dict:
+    root = Path(data_path)
+    if os.path.exists(root / header_file):
+        with open(root / header_file, 'r') as hf:
+            return json.load(hf)
+    return {'project_name': root.name}
+
+
 class DDKnowledgeGraph:
-    def __init__(self, data_path, backend=None, relative=True) -> None:
+    def __init__(self, data_path, backend=None, relative=True, on_event=None) -> None:
         self.root = Path(data_path)
         self.export_target = export
         self.backend = backend
         self.G = nx.DiGraph()
+        self.summaries = {}
+        self.generation = None
         self.project_name = None
+        self.on_event = on_event
         self.load()
 
     # Split functions into different files for readability
@@ -30,33 +43,71 @@ class DDKnowledgeGraph:
     from ._export import export_single, export_batch
     from ._inference import log_inference
     from ._cluster import update_tsne
+    from ._snapshot import save_snapshot, load_snapshot
+    from ._summary import (
+        summary_update,
+        summary_add,
+        summary_remove,
+        rebuild_summaries,
+        to_summary_json,
+        children_json,
+    )
+
+    # Notify listeners (e.g. the server push channel) of graph changes
+    def emit(self, event: str, **data):
+        if self.on_event is not None:
+            self.on_event(event, project=self.root.name, **data)
 
     # IO functions
     def load(self):
         check_dir(self.root)
 
+        # Prefer the snapshot when it was written from the same save as the json
+        if self.load_snapshot():
+            return
+
         if os.path.exists(self.root / data_file):
             with open(self.root / data_file, 'r') as df:
                 data = json.load(df)
+                self.generation = data.get('generation')
                 self.project_name = data['project_name']
                 self.export_target = Path(data['export_target'])
                 self.G = nx.cytoscape.cytoscape_graph(data['graph'])
+            self.rebuild_summaries()
+            self.save_snapshot()
 
+    # Every save bumps the generation, written as the first key of the json, header
+    # and snapshot. A snapshot is only used when its generation matches the json,
+    # which is exact even when both files are written within one mtime tick.
+    # The snapshot is written after loading from json and when a project is
+    # unloaded or the server exits, not on every save.
     def save(self):
         os.system(
             f'cp "{self.root / data_file}" "{check_dir(self.root / backups) / data_file}_{int(time())}"'
         )
-        with open(self.root / data_file, 'w') as df:
-            data = {
-                'project_name': self.project_name,
-                'export_target': str(self.export_target),
-                'graph': nx.cytoscape.cytoscape_data(self.G),
-            }
-            df.write(json.dumps(data, indent=4))
-
-    def to_json(self, mode='batch'):
+        self.generation = (self.generation or 0) + 1
+        data = {
+            'generation': self.generation,
+            'project_name': self.project_name,
+            'export_target': str(self.export_target),
+            'graph': nx.cytoscape.cytoscape_data(self.G),
+        }
+        replace_file(self.root / data_file, json.dumps(data, indent=4))
+
+        header = {
+            'generation': self.generation,
+            'project_name': self.project_name,
+            'modified': int(time()),
+            'n_nodes': self.G.number_of_nodes(),
+            'n_edges': self.G.number_of_edges(),
+        }
+        replace_file(self.root / header_file, json.dumps(header, indent=4))
+
+    def to_json(self, mode='batch', expand=()):
         if mode == 'batch':
             return nx.cytoscape.cytoscape_data(self.G)
+        elif mode == 'summary':
+            return self.to_summary_json(expand)
         elif mode == 'cluster':
             C = nx.DiGraph()
             for node, data in self.G.nodes(data=True):
@@ -67,10 +118,14 @@ class DDKnowledgeGraph:
 
     # Simple element attribute update
     def update_element(self, name: str, attrs: dict):
+        self.summary_remove(name)
         nx.function.set_node_attributes(self.G, {name: attrs})
+        self.summary_add(name)
+        self.emit('nodes_updated', names=[name], attrs=attrs)
 
     # Slightly less simple batch attribute update
     def update_batch(self, name: str, attrs: dict):
+        updated = [name]
         if 'alias' in attrs:
             # Update batch alias
             nx.function.set_node_attributes(self.G, {name: {'alias': attrs['alias']}})
@@ -80,6 +135,7 @@ class DDKnowledgeGraph:
                     if data.get('parent') == name:
                         new_alias = f'{attrs["alias"]}_{data["batch_index"]}'
                         self.G.nodes[node]['alias'] = new_alias
+                        updated.append(node)
 
         if 'tags' in attrs and attrs['tags'] != '':
             # Add tags to child tag lists
@@ -89,7 +145,12 @@ class DDKnowledgeGraph:
                     new_tags = delim.join(
                         set(data['tags'].split(delim)) | set(attrs['tags'].split(delim))
                     )
+                    self.summary_remove(node)
                     self.G.nodes[node]['tags'] = new_tags
+                    self.summary_add(node)
+                    updated.append(node)
+
+        self.emit('nodes_updated', names=list(dict.fromkeys(updated)))
 
     # Remove element (and children in the case of batches)
     def remove_element(self, name: str):
@@ -98,4 +159,8 @@ class DDKnowledgeGraph:
             if data.get('parent') == name:
                 to_remove.append(node)
 
-        self.G.remove_nodes_from(to_remove)
\ No newline at end of file
+        for node in to_remove:
+            self.summary_remove(node)
+            self.summaries.pop(node, None)
+        self.G.remove_nodes_from(to_remove)
+        self.emit('nodes_removed', names=to_remove)
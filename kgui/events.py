@@ -0,0 +1,66 @@
+import json
+import queue
+import threading
+
+from time import time
+
+
+# Fans events out to every subscriber queue. Slow subscribers lose their oldest
+# events rather than blocking the publisher.
+class EventBus:
+    def __init__(self, max_queued: int = 256) -> None:
+        self.max_queued = max_queued
+        self._subscribers = []
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    def subscribe(self) -> queue.Queue:
+        subscriber = queue.Queue(maxsize=self.max_queued)
+        with self._lock:
+            self._subscribers.append(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: queue.Queue):
+        with self._lock:
+            if subscriber in self._subscribers:
+                self._subscribers.remove(subscriber)
+
+    def publish(self, event: str, **data):
+        with self._lock:
+            self._next_id += 1
+            message = {'id': self._next_id, 'event': event, 'time': time(), **data}
+            for subscriber in self._subscribers:
+                while True:
+                    try:
+                        subscriber.put_nowait(message)
+                        break
+                    except queue.Full:
+                        try:
+                            subscriber.get_nowait()
+                        except queue.Empty:
+                            pass
+
+    # Yields Server-Sent Events, optionally only those for one project
+    def stream(self, project: str = None, keep_alive: float = 15.0):
+        subscriber = self.subscribe()
+        try:
+            yield 'retry: 3000\n\n'
+            while True:
+                try:
+                    message = subscriber.get(timeout=keep_alive)
+                except queue.Empty:
+                    yield ': keep-alive\n\n'
+                    continue
+                if project is not None and message.get('project') not in (None, project):
+                    continue
+                yield format_sse(message)
+        finally:
+            self.unsubscribe(subscriber)
+
+
+def format_sse(message: dict) -> str:
+    return (
+        f'id: {message["id"]}\n'
+        f'event: {message["event"]}\n'
+        f'data: {json.dumps(message)}\n\n'
+    )
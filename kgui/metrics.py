@@ -0,0 +1,227 @@
+import os
+import sys
+import math
+import threading
+
+from contextlib import ExitStack, contextmanager
+from time import perf_counter, time
+
+import torch
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+DURATION_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, math.inf)
+
+
+# Process lifetime high-water mark for resident memory, in bytes
+def process_peak_rss_bytes():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS reports bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+# Current resident memory in bytes (Linux only)
+def current_rss_bytes():
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def tensor_info(tensor: torch.Tensor) -> dict:
+    return {
+        'shape': list(tensor.shape),
+        'dtype': str(tensor.dtype).replace('torch.', ''),
+        'device': str(tensor.device),
+        'bytes': tensor.element_size() * tensor.nelement(),
+    }
+
+
+class Span:
+    def __init__(self, stage: str, **attrs) -> None:
+        self.stage = stage
+        self.attrs = attrs
+        self.started = time()
+        self.seconds = None
+        self.rss_growth_bytes = None
+        self.cuda_growth_bytes = None
+        self.peak_cuda_bytes = None
+        self.tensors = {}
+
+    def record_tensor(self, name: str, tensor: torch.Tensor):
+        self.tensors[name] = tensor_info(tensor)
+
+    def to_json(self) -> dict:
+        data = {
+            'stage': self.stage,
+            'started': self.started,
+            'seconds': self.seconds,
+            'rss_growth_bytes': self.rss_growth_bytes,
+            'cuda_growth_bytes': self.cuda_growth_bytes,
+            'peak_cuda_bytes': self.peak_cuda_bytes,
+            'tensors': self.tensors,
+        }
+        data.update(self.attrs)
+        return data
+
+
+# Collects the spans of a single request and reports them to a metrics registry.
+# Memory growth is the change in RSS / allocated CUDA memory over the stage, so
+# memory freed before the stage ends is not counted and concurrent stages overlap.
+# The CUDA peak is device-wide: only stages that hold the inference lock reset it
+# (reset_cuda_peak=True), so other requests never clear it mid-stage.
+class Trace:
+    def __init__(self, name: str, metrics=None) -> None:
+        self.name = name
+        self.metrics = metrics
+        self.spans = []
+
+    @contextmanager
+    def span(self, stage: str, reset_cuda_peak: bool = False, **attrs):
+        span = Span(stage, **attrs)
+        use_cuda = torch.cuda.is_available()
+        if use_cuda:
+            if reset_cuda_peak:
+                torch.cuda.reset_peak_memory_stats()
+            cuda_before = torch.cuda.memory_allocated()
+        rss_before = current_rss_bytes()
+        start = perf_counter()
+        try:
+            yield span
+        finally:
+            span.seconds = perf_counter() - start
+            rss_after = current_rss_bytes()
+            if rss_before is not None and rss_after is not None:
+                span.rss_growth_bytes = rss_after - rss_before
+            if use_cuda:
+                span.cuda_growth_bytes = torch.cuda.memory_allocated() - cuda_before
+                if reset_cuda_peak:
+                    span.peak_cuda_bytes = torch.cuda.max_memory_allocated()
+            self.spans.append(span)
+            if self.metrics is not None:
+                self.metrics.observe(self.name, span)
+
+    # Enter a context manager such as a lock, timing the wait for it as its own
+    # stage so queueing shows up separately from the work done while holding it
+    @contextmanager
+    def wait(self, stage: str, context, **attrs):
+        with ExitStack() as stack:
+            with self.span(stage, **attrs):
+                value = stack.enter_context(context)
+            yield value
+
+    def to_json(self) -> dict:
+        return {
+            'name': self.name,
+            'seconds': sum(span.seconds for span in self.spans),
+            'process_peak_rss_bytes': process_peak_rss_bytes(),
+            'spans': [span.to_json() for span in self.spans],
+        }
+
+
+class StageStats:
+    def __init__(self) -> None:
+        self.count = 0
+        self.seconds = 0.0
+        self.buckets = [0] * len(DURATION_BUCKETS)
+        self.max_rss_growth_bytes = None
+        self.max_cuda_growth_bytes = None
+        self.peak_cuda_bytes = None
+        self.tensor_bytes = 0
+
+
+def max_or_none(current, value):
+    if value is None:
+        return current
+    return value if current is None else max(current, value)
+
+
+# Aggregates spans per (trace, stage) and renders them in Prometheus text format
+class MetricsRegistry:
+    def __init__(self) -> None:
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name: str, span: Span):
+        with self._lock:
+            stats = self._stats.setdefault((name, span.stage), StageStats())
+            stats.count += 1
+            stats.seconds += span.seconds
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if span.seconds <= bound:
+                    stats.buckets[i] += 1
+            stats.max_rss_growth_bytes = max_or_none(
+                stats.max_rss_growth_bytes, span.rss_growth_bytes
+            )
+            stats.max_cuda_growth_bytes = max_or_none(
+                stats.max_cuda_growth_bytes, span.cuda_growth_bytes
+            )
+            stats.peak_cuda_bytes = max_or_none(
+                stats.peak_cuda_bytes, span.peak_cuda_bytes
+            )
+            stats.tensor_bytes += sum(t['bytes'] for t in span.tensors.values())
+
+    def to_prometheus(self) -> str:
+        with self._lock:
+            items = sorted(self._stats.items())
+            lines = [
+                '# HELP kgui_stage_duration_seconds Time spent in each request stage.',
+                '# TYPE kgui_stage_duration_seconds histogram',
+            ]
+            for (name, stage), stats in items:
+                labels = f'trace="{name}",stage="{stage}"'
+                for bound, count in zip(DURATION_BUCKETS, stats.buckets):
+                    le = '+Inf' if bound == math.inf else repr(bound)
+                    lines.append(
+                        f'kgui_stage_duration_seconds_bucket{{{labels},le="{le}"}} {count}'
+                    )
+                lines.append(f'kgui_stage_duration_seconds_sum{{{labels}}} {stats.seconds}')
+                lines.append(f'kgui_stage_duration_seconds_count{{{labels}}} {stats.count}')
+
+            lines += [
+                '# HELP kgui_stage_memory_growth_bytes Largest memory growth over a single run of a stage.',
+                '# TYPE kgui_stage_memory_growth_bytes gauge',
+            ]
+            for (name, stage), stats in items:
+                labels = f'trace="{name}",stage="{stage}"'
+                if stats.max_rss_growth_bytes is not None:
+                    lines.append(
+                        f'kgui_stage_memory_growth_bytes{{{labels},kind="rss"}} {stats.max_rss_growth_bytes}'
+                    )
+                if stats.max_cuda_growth_bytes is not None:
+                    lines.append(
+                        f'kgui_stage_memory_growth_bytes{{{labels},kind="cuda"}} {stats.max_cuda_growth_bytes}'
+                    )
+
+            lines += [
+                '# HELP kgui_stage_peak_cuda_bytes Peak CUDA memory during stages run under the inference lock.',
+                '# TYPE kgui_stage_peak_cuda_bytes gauge',
+            ]
+            for (name, stage), stats in items:
+                labels = f'trace="{name}",stage="{stage}"'
+                if stats.peak_cuda_bytes is not None:
+                    lines.append(f'kgui_stage_peak_cuda_bytes{{{labels}}} {stats.peak_cuda_bytes}')
+
+            lines += [
+                '# HELP kgui_stage_tensor_bytes_total Bytes of tensors recorded in each stage.',
+                '# TYPE kgui_stage_tensor_bytes_total counter',
+            ]
+            for (name, stage), stats in items:
+                labels = f'trace="{name}",stage="{stage}"'
+                lines.append(f'kgui_stage_tensor_bytes_total{{{labels}}} {stats.tensor_bytes}')
+
+        process_peak = process_peak_rss_bytes()
+        if process_peak is not None:
+            lines += [
+                '# HELP kgui_process_peak_rss_bytes Lifetime peak resident memory of the server process.',
+                '# TYPE kgui_process_peak_rss_bytes gauge',
+                f'kgui_process_peak_rss_bytes {process_peak}',
+            ]
+
+        return '\n'.join(lines) + '\n'
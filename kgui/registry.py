@@ -0,0 +1,179 @@
+import threading
+
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+
+from .ddkg import DDKnowledgeGraph
+
+
+# Reader/writer lock: reads run concurrently, writes are exclusive.
+# Waiting writers block new readers so mutations are not starved.
+class RWLock:
+    def __init__(self) -> None:
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = False
+        self._writers_waiting = 0
+
+    @contextmanager
+    def read(self):
+        with self._cond:
+            while self._writer or self._writers_waiting > 0:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if self._readers == 0:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self._cond:
+            self._writers_waiting += 1
+            while self._writer or self._readers > 0:
+                self._cond.wait()
+            self._writers_waiting -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writer = False
+                self._cond.notify_all()
+
+
+class ProjectError(ValueError):
+    def __init__(self, message: str, status_code: int = 400) -> None:
+        super().__init__(message)
+        self.status_code = status_code
+
+
+# The graph is filled in once loaded; until then other requests wait on `loaded`
+class ProjectEntry:
+    def __init__(self) -> None:
+        self.ddkg = None
+        self.error = None
+        self.loaded = threading.Event()
+        self.lock = RWLock()
+        self.pins = 0
+
+
+# Keeps several projects resident, unloading the least recently used ones.
+# Projects are loaded outside the registry lock, so a slow load does not block
+# requests for projects that are already resident.
+class ProjectRegistry:
+    def __init__(self, project_dir, max_loaded: int = 4, on_event=None) -> None:
+        self.project_dir = Path(project_dir)
+        self.max_loaded = max_loaded
+        self.on_event = on_event
+        self.current = None
+        self._entries = OrderedDict()
+        self._loading = {}
+        self._evicted = []
+        self._lock = threading.Lock()
+
+    # Loads (creating if needed) a project and makes it the default for requests
+    def load(self, name: str) -> DDKnowledgeGraph:
+        entry = self._pin(name, create=True)
+        try:
+            with self._lock:
+                self.current = name
+            return entry.ddkg
+        finally:
+            self._unpin(entry)
+
+    # Write fast-load snapshots of every resident project (e.g. at shutdown)
+    def save_snapshots(self):
+        with self._lock:
+            entries = list(self._entries.values())
+        for entry in entries:
+            with entry.lock.read():
+                entry.ddkg.save_snapshot()
+
+    @contextmanager
+    def read(self, name: str):
+        entry = self._pin(name)
+        try:
+            with entry.lock.read():
+                yield entry.ddkg
+        finally:
+            self._unpin(entry)
+
+    @contextmanager
+    def write(self, name: str):
+        entry = self._pin(name)
+        try:
+            with entry.lock.write():
+                yield entry.ddkg
+        finally:
+            self._unpin(entry)
+
+    # Only plain names of existing project directories are accepted, unless creating
+    def _check_name(self, name: str, create: bool = False):
+        if name is None:
+            raise ProjectError('No project selected')
+        if name in ('', '.', '..') or '/' in name or '\\' in name:
+            raise ProjectError(f'Invalid project name: {name}')
+        if not create and not (self.project_dir / name).is_dir():
+            raise ProjectError(f'Project not found: {name}', status_code=404)
+
+    def _pin(self, name: str, create: bool = False) -> ProjectEntry:
+        self._check_name(name, create)
+        with self._lock:
+            entry = self._entries.get(name) or self._loading.get(name)
+            is_new = entry is None
+            if is_new:
+                entry = self._loading[name] = ProjectEntry()
+            elif name in self._entries:
+                self._entries.move_to_end(name)
+            entry.pins += 1
+
+        if is_new:
+            try:
+                entry.ddkg = DDKnowledgeGraph(
+                    str(self.project_dir / name), on_event=self.on_event
+                )
+            except BaseException as e:
+                entry.error = e
+            with self._lock:
+                del self._loading[name]
+                if entry.error is None:
+                    self._entries[name] = entry
+                    self._evict(keep=name)
+            entry.loaded.set()
+        else:
+            entry.loaded.wait()
+
+        if entry.error is not None:
+            self._unpin(entry)
+            raise entry.error
+        self._snapshot_evicted()
+        return entry
+
+    def _unpin(self, entry: ProjectEntry):
+        with self._lock:
+            entry.pins -= 1
+            self._evict()
+        self._snapshot_evicted()
+
+    # Snapshots of unloaded projects are written outside the registry lock
+    def _snapshot_evicted(self):
+        with self._lock:
+            evicted, self._evicted = self._evicted, []
+        for entry in evicted:
+            with entry.lock.read():
+                entry.ddkg.save_snapshot()
+
+    # Drop least recently used projects that are not in use.
+    # Every mutation saves before releasing its lock, so nothing is lost.
+    # Must be called with self._lock held.
+    def _evict(self, keep: str = None):
+        for name in list(self._entries):
+            if len(self._entries) <= self.max_loaded:
+                break
+            if self._entries[name].pins == 0 and name not in (self.current, keep):
+                self._evicted.append(self._entries.pop(name))
@@ -1,8 +1,11 @@
 import os
+import tempfile
 import torchaudio
 
 # subdirectories
 data_file = "ddkg.json"
+snapshot_file = "snapshot.json"
+header_file = "header.json"
 model_dir = "models"
 audio_dir = "audio"
 backups = "backup"
@@ -14,6 +17,17 @@ def check_dir(dir):
         os.makedirs(dir, exist_ok=True)
     return dir
 
+# Write to a temporary file first so a crash never leaves a truncated file behind
+def replace_file(path, data, mode='w'):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, mode) as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
 def load_audio(device, audio_path: str, sample_rate):
     
     if not os.path.exists(audio_path):
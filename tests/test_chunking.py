@@ -0,0 +1,107 @@
+import pytest
+
+torch = pytest.importorskip('torch')
+
+from kgui.chunking import chunk_windows, recombine_chunks, split_chunks
+
+
+# The per-chunk loop recombine_chunks replaced, with the last chunk no longer
+# getting a right fade (the old `chunk_index < len(output_chunks)` was always true)
+def reference_recombine(output_chunks, length, chunk_size, chunk_interval, crossfade):
+    output = torch.zeros(*output_chunks[0].shape[:-1], length)
+    overlap = chunk_size - chunk_interval
+    left_fade = torch.zeros(chunk_size)
+    right_fade = torch.zeros(chunk_size)
+    if crossfade:
+        left_fade[:overlap] += torch.linspace(0, 1, overlap)
+        left_fade[overlap:] += 1
+        right_fade[-overlap:] += torch.linspace(1, 0, overlap)
+        right_fade[:-overlap] += 1
+    else:
+        left_fade[:] += 1
+        right_fade[:chunk_interval] += 1
+    for chunk_index, chunk in enumerate(output_chunks):
+        chunk = chunk.clone()
+        start = chunk_index * chunk_interval
+        end = min(start + chunk_size, output.size(-1))
+        if chunk_index > 0:
+            chunk *= left_fade
+        if chunk_index < len(output_chunks) - 1:
+            chunk *= right_fade
+        output[..., start:end] += chunk[..., : end - start]
+    return output
+
+
+def split_and_recombine(audio, chunk_size, chunk_interval, crossfade, batch_size=3):
+    chunks = [
+        chunk.unsqueeze(0).repeat(batch_size, 1, 1)
+        for chunk in split_chunks(audio, chunk_size, chunk_interval)
+    ]
+    return recombine_chunks(
+        chunks, audio.size(-1), chunk_size, chunk_interval, crossfade
+    )
+
+
+@pytest.mark.parametrize('crossfade', [True, False])
+@pytest.mark.parametrize(
+    'length, chunk_size, chunk_interval',
+    [
+        (1000, 64, 48),  # length not a multiple of the interval
+        (960, 64, 48),
+        (1000, 64, 32),  # chunk_interval == overlap
+        (1000, 64, 64),  # no overlap
+        (40, 64, 48),  # a single chunk
+    ],
+)
+def test_split_recombine_reconstructs(length, chunk_size, chunk_interval, crossfade):
+    torch.manual_seed(0)
+    audio = torch.rand(2, length) * 2 - 1
+    output = split_and_recombine(audio, chunk_size, chunk_interval, crossfade)
+    assert output.shape == (3, 2, length)
+    torch.testing.assert_close(output, audio.expand(3, -1, -1))
+
+
+def test_split_chunks_are_independent():
+    audio = torch.rand(2, 200)
+    chunks = split_chunks(audio, 64, 48)
+    assert len(chunks) == 5
+    chunks[0].zero_()
+    torch.testing.assert_close(chunks[1], audio[:, 48:112])
+
+
+@pytest.mark.parametrize('chunk_size, chunk_interval', [(64, 48), (64, 32), (65536, 49152)])
+def test_equal_power_windows_square_sum_to_one(chunk_size, chunk_interval):
+    first, _, last = chunk_windows(chunk_size, chunk_interval, True, 'equal_power')
+    overlap = chunk_size - chunk_interval
+    fade_out = first[chunk_interval:]
+    fade_in = last[:overlap]
+    torch.testing.assert_close(fade_out**2 + fade_in**2, torch.ones(overlap))
+
+
+def test_recombine_leaves_chunks_untouched():
+    output_chunks = [torch.rand(3, 2, 64) for _ in range(5)]
+    before = [chunk.clone() for chunk in output_chunks]
+    recombine_chunks(output_chunks, 250, 64, 48, True)
+    for chunk, expected in zip(output_chunks, before):
+        torch.testing.assert_close(chunk, expected)
+
+
+def test_unknown_window_raises():
+    with pytest.raises(ValueError):
+        chunk_windows(64, 48, True, 'hann')
+
+
+@pytest.mark.parametrize('crossfade', [True, False])
+@pytest.mark.parametrize('length', [1000, 960])
+def test_matches_reference_loop(length, crossfade):
+    torch.manual_seed(0)
+    chunk_size, chunk_interval = 64, 48
+    n_chunks = len(split_chunks(torch.zeros(2, length), chunk_size, chunk_interval))
+    output_chunks = [torch.rand(3, 2, chunk_size) for _ in range(n_chunks)]
+    expected = reference_recombine(
+        output_chunks, length, chunk_size, chunk_interval, crossfade
+    )
+    output = recombine_chunks(
+        output_chunks, length, chunk_size, chunk_interval, crossfade
+    )
+    torch.testing.assert_close(output, expected)